@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the import, the quality control and the final labels on the
+small vlinder test dataset.
+
+Each step is repeated on a fresh dataset and the best and median timings are
+printed. The first repetition includes the compilation of the numba checks (if
+numba is installed), so it is not counted.
+
+Usage: python development/benchmark_qc.py [number of repetitions]
+"""
+
+import os, sys, time
+import numpy as np
+from pathlib import Path
+
+
+lib_folder = Path(__file__).resolve().parents[1]
+sys.path.append(str(lib_folder))
+
+from src import vlinder_toolkit
+
+testdatafile = os.path.join(str(lib_folder), 'tests', 'test_data',  'vlinderdata_small.csv')
+
+
+def run_once():
+    """ Run all steps on a fresh dataset and return the timing (in seconds) per step. """
+    timings = {}
+    dataset = vlinder_toolkit.Dataset()
+
+    start = time.perf_counter()
+    dataset.import_data_from_file(coarsen_timeres=True)
+    timings['import (with coarsening)'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dataset.apply_quality_control(obstype='temp')
+    timings['apply_quality_control on temp'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dataset.get_final_qc_labels()
+    timings['get_final_qc_labels'] = time.perf_counter() - start
+    return timings
+
+
+if __name__ == '__main__':
+    num_repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    settings = vlinder_toolkit.Settings()
+    settings.update_settings(input_data_file=testdatafile)
+    settings.check_settings()
+
+    #warm up (numba compilation, file system cache)
+    run_once()
+
+    all_timings = [run_once() for _ in range(num_repeats)]
+
+    print(f'\nTimings over {num_repeats} repetitions:')
+    for step in all_timings[0].keys():
+        step_timings = np.array([timings[step] for timings in all_timings])
+        print(f'    {step}: best {step_timings.min():.3f} s, median {np.median(step_timings):.3f} s')
@@ -55,4 +55,5 @@ __version__ = "version debug"
 # =============================================================================
 
 from .dataset import get_lcz
+from .qc_checks import warmup_qc
 
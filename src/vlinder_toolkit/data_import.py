@@ -6,15 +6,25 @@ Created on Thu Sep 22 16:24:06 2022
 @author: thoverga
 """
 import sys, os
+import csv
+import io
+import json
+import hashlib
+import logging
+import importlib.util
 # import json
 # import datetime
 import pandas as pd
 
-import mysql.connector
-from mysql.connector import errorcode
 from pathlib import Path
-from .data_templates.import_templates import read_templates
+from .data_templates.import_templates import read_templates, csv_templates_list
+from .data_templates.db_templates import vlinder_metadata_db_template, vlinder_observations_db_template
 
+logger = logging.getLogger(__name__)
+
+#String columns with only a few unique values (repeated for each record), these
+#are stored as categoricals.
+categorical_string_columns = ['name', 'network', 'call_name', 'location']
 
 def template_to_package_space(specific_template):
     
@@ -25,9 +35,152 @@ def template_to_package_space(specific_template):
        returndict[key].update(orig_dict)
    return returndict
 
+def find_csv_seperator(input_file, seperators, sample_size=8192):
+    """
+    Detect the column seperator of a csv file by only reading the head of the file.
+    
+    The seperator is sniffed on a sample of the file (csv.Sniffer). If sniffing fails,
+    the first seperator that splits the sample in more than one column is returned.
+
+    Parameters
+    ----------
+    input_file : str
+        Path to the csv file.
+    seperators : list
+        The candidate seperators, in order of preference.
+    sample_size : int, optional
+        Number of characters to read from the head of the file. The default is 8192.
+
+    Returns
+    -------
+    sep : str
+        The detected seperator.
+
+    """
+    with open(input_file, 'r', errors='replace') as f:
+        sample = f.read(sample_size)
+    assert bool(sample), "Dataset is empty!"
+    
+    #The sniffer can only handle single-character delimiters
+    sniff_delimiters = ''.join([sep for sep in seperators if len(sep) == 1])
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=sniff_delimiters).delimiter
+    except csv.Error:
+        pass
+    
+    #Drop the last (possibly truncated) line of the sample
+    sample = sample[:sample.rfind('\n')+1] if '\n' in sample else sample
+    for sep in seperators:
+        if len(pd.read_csv(io.StringIO(sample), sep=sep).columns) > 1:
+            return sep
+    return seperators[0]
+
+
+def find_csv_header(input_file, sep, n_lines=64):
+    """
+    Find the line number of the header in a csv file, by scanning the head of the 
+    file for pieces of text above the measurements. 
+    
+    If the first line has empty columnnames, the header is the first line with
+    the same number of values as a line of measurements (the third last scanned line). 
+
+    Parameters
+    ----------
+    input_file : str
+        Path to the csv file.
+    sep : str
+        Seperator of the columns.
+    n_lines : int, optional
+        Number of lines to scan. The default is 64.
+
+    Returns
+    -------
+    header : int
+        Number of lines above the header.
+
+    """
+    with open(input_file, 'r', errors='replace') as f:
+        head = [line for _, line in zip(range(n_lines), f)]
+    assert bool(head), "Dataset is empty!"
+    
+    if len(sep) == 1:
+        rows = list(csv.reader(head, delimiter=sep))
+    else:
+        rows = [line.rstrip('\r\n').split(sep) for line in head]
+    
+    #No text above the header if all columnnames are given
+    if not '' in [field.strip() for field in rows[0]]:
+        return 0
+    
+    counts = [len([field for field in row if field.strip() != '']) for row in rows]
+    num_columns = counts[-3] if len(counts) >= 3 else counts[-1]
+    
+    return next((i for i, count in enumerate(counts) if count == num_columns), 0)
+
+
+def read_csv_file(input_file, sep, string_columns=None, usecols=None, skiprows=0,
+                  fast_io=False, chunksize=None):
+    """
+    Read a csv file into a pandas dataframe. 
+    
+    If fast_io is True, the file is read by the multithreaded pyarrow csv reader.
+    When pyarrow is not installed, or the file can not be read by pyarrow 
+    (i.g. text before the header), the default pandas reader is used.
+
+    Parameters
+    ----------
+    input_file : str
+        Path to the csv file.
+    sep : str
+        Seperator of the columns.
+    string_columns : list, optional
+        Columns that are read as strings (i.g. datetime columns that are parsed 
+        by the format of the template). The default is None.
+    usecols : list, optional
+        The columns to read. If None, all columns are read. The default is None.
+    skiprows : int, optional
+        Number of lines above the header. The default is 0.
+    fast_io : Bool, optional
+        If True, the pyarrow reader is used. The default is False.
+    chunksize : int, optional
+        If given, the pandas reader returns an iterator over chunks of this number
+        of rows. The pyarrow reader always returns the full dataframe. The default is None.
+
+    Returns
+    -------
+    pandas.DataFrame or pandas.io.parsers.TextFileReader
+        The content of the csv file.
+
+    """
+    if isinstance(string_columns, type(None)):
+        string_columns = []
+    
+    if fast_io:
+        try:
+            import pyarrow as pa
+            from pyarrow import csv as pa_csv
+            
+            table = pa_csv.read_csv(input_file,
+                                    read_options=pa_csv.ReadOptions(skip_rows=skiprows),
+                                    parse_options=pa_csv.ParseOptions(delimiter=sep),
+                                    convert_options=pa_csv.ConvertOptions(column_types={column: pa.string() for column in string_columns},
+                                                                          include_columns=usecols,
+                                                                          strings_can_be_null=True))
+            return table.to_pandas()
+        except ImportError:
+            logger.warning('pyarrow is not installed, the default csv reader is used.')
+        except ValueError as e:
+            logger.warning(f'pyarrow could not read {input_file} ({e}), the default csv reader is used.')
+    
+    return pd.read_csv(input_file, sep=sep, skiprows=skiprows, usecols=usecols,
+                       dtype={column: str for column in string_columns},
+                       chunksize=chunksize)
+
+
 def find_compatible_templatefor(df_columns, template_list):
+   columns = set(df_columns)
    for templ in template_list:
-       found =  all(keys in list(df_columns) for keys in templ.keys())
+       found = templ.keys() <= columns
        if found:
            print('Compatible template found. ')
            return templ
@@ -63,40 +216,57 @@ def compress_dict(nested_dict, valuesname):
     return returndict    
     
 
+#Compiled templates, stored by id of the template (the template itself is kept
+#as reference, so the id can not be reused by another object).
+_compiled_templates = {}
 
-
-# def coarsen_time_resolution(df, freq='H', method='bfill'):
-    
-#     #TODO: implement buffer method
+def compile_template(templ):
+    """
+    Convert a template to the package space and make the column mappers. The 
+    result is cached per template object, so the conversion is only done once
+    per template.
     
-#     if method=='bfill':
-#         #apply per station
-#         resample_df = pd.DataFrame()
-#         for stationname in df['name'].unique():
-#             subdf = df[df['name'] == stationname]
-            
-            
-#             #  Check if index is unique
-#             if not subdf.index.is_unique:
-#                 print('Duplicate timestamp found !!, this will be removed')
-#                 dup_mask = subdf.index.duplicated(keep='first')
-#                 subdf = subdf[~dup_mask]
-#                 subdf = subdf.sort_index()
+    The returned dictionaries are shared, so they should not be modified.
 
-            
-            
-#             resample_subdf = subdf.resample(rule=freq,
-#                                             axis='index').bfill()
-                             
-#             resample_df = pd.concat([resample_df, resample_subdf])
-            
-#         return resample_df
-    
+    Parameters
+    ----------
+    templ : dict
+        A template with the column names of the file as keys.
 
-def import_metadata_from_csv(input_file, file_csv_template, template_list):
+    Returns
+    -------
+    template : dict
+        The template in the package space (see template_to_package_space).
+    varname_mapper : dict
+        {column name: varname} mapper to rename the columns.
+    dtype_mapper : dict
+        {column name: dtype} mapper.
+
+    """
+    if not id(templ) in _compiled_templates:
+        _compiled_templates[id(templ)] = (templ, (template_to_package_space(templ),
+                                                  compress_dict(templ, 'varname'),
+                                                  compress_dict(templ, 'dtype')))
+    return _compiled_templates[id(templ)][1]
+
+#Compile the default templates on import
+for _templ in csv_templates_list + [vlinder_metadata_db_template, vlinder_observations_db_template]:
+    compile_template(_templ)
+
+
+
+
+def import_metadata_from_csv(input_file, file_csv_template, template_list, fast_io=None):
     assert not isinstance(input_file, type(None)), "Specify input file in the settings!"    
     
-    df = pd.read_csv(input_file, sep=';')
+    #The metadata file is small and read for every dataset, so by default the
+    #pyarrow reader is used when it is installed.
+    if isinstance(fast_io, type(None)):
+        fast_io = importlib.util.find_spec('pyarrow') is not None
+    
+    #columns with a datetime format are kept as strings
+    string_columns = [column for templ in template_list for column, info in templ.items() if 'format' in info]
+    df = read_csv_file(input_file, sep=';', string_columns=string_columns, fast_io=fast_io)
     
     assert not df.empty, "Dataset is empty!"
     
@@ -112,80 +282,51 @@ def import_metadata_from_csv(input_file, file_csv_template, template_list):
         templ = file_csv_template
         
     #Check if template is compatible with the data, and try other templates if not
-    if not all(keys in list(df.columns) for keys in templ.keys()):
+    if not templ.keys() <= set(df.columns):
         print("Default template not compatible, scanning other templates ...")
         templ = find_compatible_templatefor(df_columns=df.columns,
                                             template_list=template_list)
     
 
     # rename columns to toolkit attriute names
-    df = df.rename(columns=compress_dict(templ, 'varname'))
+    _template, varname_mapper, _dtype_mapper = compile_template(templ)
+    df = df.rename(columns=varname_mapper)
 
     return df 
     
 
 
-def import_data_from_csv(input_file, file_csv_template, template_list):
-    
-    common_seperators = [';',',','    ']
-    assert not isinstance(input_file, type(None)), "Specify input file in the settings!"
-    for sep in common_seperators:
-        
-        df = pd.read_csv(input_file, sep=sep)
-        assert not df.empty, "Dataset is empty!"
-        
-        if len(df.columns) > 1:
-            break
-    
-    assert len(df.columns) > 1, f'Only one column detected from import using these seperators: {common_seperators}. See if csv template is correct.'
-        
-        
-    # LINES TO DEAL WITH RANDOM PIECES OF TEXT BEFORE ACTUAL MEASUREMENTS
-    if (True in df.columns.str.contains(pat = 'Unnamed')):
-        num_columns = df.iloc[-3].count().sum()
-        
-        rows_to_skip = 0
-        for row in range(len(df)):
-            if df.iloc[row:(row+1),:].count().sum() != num_columns:
-                rows_to_skip += 1
-            else:
-                break
-        df = df.iloc[rows_to_skip:,:]
-        df = df.rename(columns=df.iloc[0]).iloc[1:,:]
-    df.index = range(len(df))
+def format_observations_chunk(df, templ):
+    """
+    Convert a (chunk of a) raw csv dataframe to the toolkit space. The float
+    columns are converted to numeric, the columns are renamed, the datetimes are
+    parsed and set as index and only the columns of the template are kept.
 
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The raw observations as read from the csv file.
+    templ : dict
+        The template of the csv file.
 
-        
-    # import template
-    if isinstance(file_csv_template, type(None)): #No default template is given
-        
-        templ = find_compatible_templatefor(df_columns=df.columns,
-                                            template_list=template_list)
-    else:
-        templ=file_csv_template
+    Returns
+    -------
+    df : pandas.DataFrame
+        The formatted observations with a datetime index.
 
-    #Check if template is compatible and find other if needed
-    if not all(keys in list(df.columns) for keys in templ.keys()):
-        print('Default template is not compatible, scanning for other templates ...')
-        
-        
-        templ = find_compatible_templatefor(df_columns=df.columns,
-                                            template_list=template_list)
-    
+    """
+    template, varname_mapper, dtype_mapper = compile_template(templ)
     
     for key, value in templ.items():
-        if value['dtype'] == 'float64':
+        if (value['dtype'] == 'float64') & (not pd.api.types.is_numeric_dtype(df[key])):
             
             df[key] = pd.to_numeric(df[key], errors='coerce')
             
         
     
     # rename columns to toolkit attriute names
-    df = df.rename(columns=compress_dict(templ, 'varname'))
+    df = df.rename(columns=varname_mapper)
     
-    #COnvert template to package-space
-    template =template_to_package_space(templ)
-   
     #format columns
     #df = df.astype(dtype=compress_dict(template, 'dtype'))
     
@@ -195,8 +336,10 @@ def import_data_from_csv(input_file, file_csv_template, template_list):
                                         format=template['datetime']['format'])
     
     else:
-        datetime_fmt = template['_date']['format'] + ' ' + template['_time']['format']
-        df['datetime'] =pd.to_datetime(df['_date'] +' ' + df['_time'], format=datetime_fmt)
+        #parse dates and times seperatly (no string concatenation), the few unique values are parsed once (cache)
+        dates = pd.to_datetime(df['_date'], format=template['_date']['format'], cache=True)
+        times = pd.to_datetime(df['_time'], format=template['_time']['format'], cache=True) - pd.Timestamp('1900-01-01')
+        df['datetime'] = dates + times
         df = df.drop(columns=['_date', '_time'])
     
     #Set datetime index
@@ -206,9 +349,128 @@ def import_data_from_csv(input_file, file_csv_template, template_list):
     
     
     #Keep only columns as defined in the template
-    for column in df.columns:
-        if not (column in template.keys()):
-            df = df.drop(columns=[column])
+    df = df[[column for column in df.columns if column in template.keys()]]
+    
+    return df
+
+
+def get_csv_cache_files(cache_folder, input_file, file_csv_template, template_list):
+    """
+    Get the paths of the cache files (observations as parquet and template as json)
+    for an observations csv file. The cache key depends on the path, the 
+    modification time and the size of the csv file and on the templates, so a
+    changed file (or template) is never read from an old cache.
+
+    Parameters
+    ----------
+    cache_folder : String
+        The folder to store the cache files in.
+    input_file : String
+        Path of the observations csv file.
+    file_csv_template : dict or None
+        The csv template given in the settings.
+    template_list : list
+        The list of available templates.
+
+    Returns
+    -------
+    parquet_file : String
+        Path of the cached observations.
+    template_file : String
+        Path of the cached template.
+
+    """
+    file_stat = os.stat(input_file)
+    key = repr((os.path.abspath(input_file), file_stat.st_mtime_ns, file_stat.st_size,
+                file_csv_template, template_list))
+    cache_name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return (os.path.join(cache_folder, cache_name + '.parquet'),
+            os.path.join(cache_folder, cache_name + '.json'))
+
+
+def import_data_from_csv(input_file, file_csv_template, template_list, fast_io=False,
+                         chunksize=500000, cache_folder=None):
+    
+    common_seperators = [';',',','    ']
+    assert not isinstance(input_file, type(None)), "Specify input file in the settings!"
+    
+    #Read the formatted observations from the cache (if available)
+    use_cache = ((not isinstance(cache_folder, type(None))) and
+                 (importlib.util.find_spec('pyarrow') is not None))
+    if use_cache:
+        parquet_file, template_file = get_csv_cache_files(cache_folder, input_file,
+                                                          file_csv_template, template_list)
+        if os.path.isfile(parquet_file) and os.path.isfile(template_file):
+            logger.info(f'Reading the formatted observations from the cache: {parquet_file}')
+            df = pd.read_parquet(parquet_file, engine='pyarrow')
+            with open(template_file, 'r') as f:
+                template = json.load(f)
+            return df, template
+    
+    #Detect the seperator on the head of the file, so the file is only parsed once
+    sep = find_csv_seperator(input_file, seperators=common_seperators)
+    
+    #Find the header, by scanning for pieces of text above the measurements
+    skiprows = find_csv_header(input_file, sep=sep)
+    
+    #Read the head of the measurements to find the template
+    df = pd.read_csv(input_file, sep=sep, skiprows=skiprows, nrows=5)
+    assert not df.empty, "Dataset is empty!"
+    
+    assert len(df.columns) > 1, f'Only one column detected from import using these seperators: {common_seperators}. See if csv template is correct.'
+        
+        
+    # import template
+    if isinstance(file_csv_template, type(None)): #No default template is given
+        
+        templ = find_compatible_templatefor(df_columns=df.columns,
+                                            template_list=template_list)
+    else:
+        templ=file_csv_template
+
+    #Check if template is compatible and find other if needed
+    if not templ.keys() <= set(df.columns):
+        print('Default template is not compatible, scanning for other templates ...')
+        
+        
+        templ = find_compatible_templatefor(df_columns=df.columns,
+                                            template_list=template_list)
+    
+    #Only read the template columns, datetime columns are read as strings
+    usecols = [column for column in df.columns if column in templ.keys()]
+    if skiprows > 0:
+        #The values are read as strings, as they are when mixed with the text above the header.
+        string_columns = usecols
+    else:
+        string_columns = [column for column in usecols if 'format' in templ[column]]
+    
+    #Read the file in chunks, so only the formatted observations are kept in memory
+    reader = read_csv_file(input_file, sep=sep, string_columns=string_columns,
+                           usecols=usecols, skiprows=skiprows,
+                           fast_io=fast_io, chunksize=chunksize)
+    if isinstance(reader, pd.DataFrame):
+        reader = iter([reader])
+    
+    #COnvert template to package-space
+    template, _varname_mapper, _dtype_mapper = compile_template(templ)
+    
+    #format the chunks and combine them
+    df_list = []
+    for chunk in reader:
+        df_list.append(format_observations_chunk(chunk, templ))
+    df = pd.concat(df_list)
+    
+    for column in categorical_string_columns:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    
+    #Store the formatted observations in the cache
+    if use_cache:
+        logger.info(f'Writing the formatted observations to the cache: {parquet_file}')
+        os.makedirs(cache_folder, exist_ok=True)
+        df.to_parquet(parquet_file, engine='pyarrow', compression='zstd')
+        with open(template_file, 'w') as f:
+            json.dump(template, f)
     
     # add template to the return
     
@@ -223,6 +485,10 @@ def import_data_from_database(Settings,
     # Make connection to database
     # =============================================================================
     
+    #import here, so csv-only workflows do not pay the import of the connector
+    import mysql.connector
+    from mysql.connector import errorcode
+    
     #Make connection with database (needs ugent VPN active)
     
     try:
@@ -251,22 +517,17 @@ def import_data_from_database(Settings,
     
     
     metadata_Query = "select * from " + Settings.db_meta_table
-    cursor = connection.cursor()
-    cursor.execute(metadata_Query)
-    metadata = cursor.fetchall()
-    metadata = pd.DataFrame(metadata)
-    # metadata_columns = list(cursor.column_names)
-    
-    metadata.columns = list(cursor.column_names)
+    metadata = pd.read_sql(metadata_Query, connection)
     
     #subset relevent columns
     metadata = metadata[list(Settings.vlinder_db_meta_template.keys())]
     
+    #COnvert template to package-space
+    template, meta_varname_mapper, _meta_dtype_mapper = compile_template(Settings.vlinder_db_meta_template)
+    
     #rename columns to standards
-    metadata = metadata.rename(columns=compress_dict(Settings.vlinder_db_meta_template, 'varname'))
+    metadata = metadata.rename(columns=meta_varname_mapper)
     
-    #COnvert template to package-space
-    template = template_to_package_space(Settings.vlinder_db_meta_template)
     
     
     #format columns
@@ -291,21 +552,15 @@ def import_data_from_database(Settings,
         print( "NOT IMPLEMENTED YET")
         obs_type_query_str = '*' 
     
-    #format datetime
-    
-    datetime_db_info = [item for item in Settings.vlinder_db_obs_template.values() if item['varname'] == 'datetime'][0]
-    
-    startstring = start_datetime.strftime(format=datetime_db_info['fmt']) #datetime to string
-    endstring = end_datetime.strftime(format=datetime_db_info['fmt']) #datetime to string
-    _inverted_template = template_to_package_space(Settings.vlinder_db_obs_template)
+    _inverted_template, obs_varname_mapper, obs_dtype_mapper = compile_template(Settings.vlinder_db_obs_template)
     datetime_column_name = _inverted_template['datetime']['orig_name']
     
     
-    #select all stations
+    #select all stations (the datetimes are passed as query parameters and filtered by the server)
     obsdata_Query=str(r"SELECT ") + obs_type_query_str + ' ' + \
             str(r"FROM ") + Settings.db_obs_table + str(' ') + \
-            str(r"WHERE ") + datetime_column_name +  str(r">='") + startstring  + str(r"' AND ") + \
-            datetime_column_name +  str(r"<='") + endstring  + str(r"'  ") + \
+            str(r"WHERE ") + datetime_column_name +  str(r">=%s AND ") + \
+            datetime_column_name +  str(r"<=%s ") + \
             str(r"ORDER BY ") + datetime_column_name
     
     
@@ -317,22 +572,27 @@ def import_data_from_database(Settings,
     
     
     
-    cursor.execute(obsdata_Query)
-    obsdata = cursor.fetchall()
-    obsdata = pd.DataFrame(obsdata)
-    
-    
-    
-    obsdata.columns = list(cursor.column_names)
+    #read the records in chunks, so they are not all kept as python tuples
+    obsdata_chunks = list(pd.read_sql(obsdata_Query, connection,
+                                      params=(start_datetime, end_datetime),
+                                      parse_dates=[datetime_column_name],
+                                      chunksize=200000))
+    if bool(obsdata_chunks):
+        obsdata = pd.concat(obsdata_chunks, ignore_index=True)
+    else:
+        #no records in the period (there are no chunks to concat)
+        logger.warning(f'No observations found in the database between {start_datetime} and {end_datetime}.')
+        obsdata = pd.DataFrame(columns=list(Settings.vlinder_db_obs_template.keys()))
+        obsdata[datetime_column_name] = pd.to_datetime(obsdata[datetime_column_name])
     
     #subset relevent columns
     obsdata = obsdata[list(Settings.vlinder_db_obs_template.keys())]
     
-    #format columns
-    obsdata = obsdata.astype(dtype=compress_dict(Settings.vlinder_db_obs_template, 'dtype'))
-    
-    #rename columns to standards
-    obsdata = obsdata.rename(columns=compress_dict(Settings.vlinder_db_obs_template, 'varname'))
+    #rename columns to standards and format columns (the datetimes are already parsed)
+    obsdata = obsdata.rename(columns=obs_varname_mapper)
+    obsdata = obsdata.astype(dtype={obs_varname_mapper[column]: dtype for column, dtype in obs_dtype_mapper.items()
+                                    if column != datetime_column_name},
+                             copy=False)
     
     
     connection.close()
@@ -342,12 +602,13 @@ def import_data_from_database(Settings,
     # merge Observatios and metadata
     # =============================================================================
     
-    combdata = obsdata.merge(metadata,
-                             how='left',
-                             on='id')
+    combdata = obsdata.join(metadata.set_index('id'),
+                            how='left',
+                            on='id')
     combdata = combdata.drop(columns=['id'])
-    combdata['datetime'] =pd.to_datetime(combdata['datetime'],
-                                    format=datetime_db_info['fmt']) 
+    for column in categorical_string_columns:
+        if column in combdata.columns:
+            combdata[column] = combdata[column].astype('category')
     #TODO implement timezone settings
     
     
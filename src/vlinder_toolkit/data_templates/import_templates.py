@@ -70,9 +70,7 @@ csv_templates_list = excel_templates
 # Check if templates column names are unique
 # =============================================================================
 def check_if_templates_are_unique_defined(templatelist):
-    templ_df = pd.DataFrame()
-    for templ in templatelist:
-        templ_df = templ_df.append(pd.Series(templ.keys()), ignore_index=True)
+    templ_df = pd.DataFrame([pd.Series(list(templ.keys()), dtype=object) for templ in templatelist])
     
     #if all columnnames are identical to other template (type 1)
     if templ_df.duplicated().any():
@@ -14,8 +14,7 @@ from datetime import datetime
 import logging
 
 from .settings import Settings
-from .data_import import import_data_from_csv, import_data_from_database, template_to_package_space, import_metadata_from_csv
-# from .data_import import coarsen_time_resolution
+from .data_import import import_data_from_csv, import_data_from_database, compile_template, import_metadata_from_csv
 from .landcover_functions import geotiff_point_extraction
 from .geometry_functions import find_largest_extent
 from .plotting_functions import spatial_plot, timeseries_plot, timeseries_comp_plot, qc_stats_pie
@@ -23,6 +22,7 @@ from .plotting_functions import spatial_plot, timeseries_plot, timeseries_comp_p
 from .qc_checks import gross_value_check, persistance_check, repetitions_check, duplicate_timestamp_check
 from .qc_checks import step_check, missing_timestamp_and_gap_check, get_freqency_series
 from .qc_checks import init_outlier_multiindexdf, gaps_to_outlier_format, window_variation_check
+from .qc_checks import station_bounds
 
 from .statistics import get_qc_effectiveness_stats
 
@@ -45,9 +45,9 @@ static_fields = ['network', 'name',
 categorical_fields = ['wind_direction', 'lcz']
 
 
-observation_types = ['temp', 'radiation_temp', 'humidity', 'precip',
+observation_types = ('temp', 'radiation_temp', 'humidity', 'precip',
                      'precip_sum', 'wind_speed', 'wind_gust', 'wind_direction',
-                     'pressure', 'pressure_at_sea_level']
+                     'pressure', 'pressure_at_sea_level')
 
 location_info = ['network', 'lat', 'lon', 'lcz', 'call_name', 'location' ]
 
@@ -71,9 +71,77 @@ class Dataset:
         self.metadf = pd.DataFrame() #Dataset with metadata (static)
         self.data_template = pd.DataFrame() #dataframe containing all information on the description and mapping
         
-        self._freqs = pd.Series()
+        self._station_slices = {} #name --> slice of the station records in self.df
+        self._station_slices_index = None #the self.df index for which the slices are computed
         
     
+    def get_station_slices(self):
+        """
+        Get the position of the records of each station in the observations dataframe.
+        The records of a station are a contiguous block in the (name, datetime) sorted
+        dataframe, so a station can be sliced out without scanning all the names.
+        
+        The slices are computed once and reused as long as the index of the
+        dataframe does not change.
+
+        Returns
+        -------
+        station_slices : dict
+            A dictionary {stationname: slice} with the positions of the station records in Dataset.df.
+
+        """
+        if self._station_slices_index is not self.df.index:
+            if ((not isinstance(self.df.index, pd.MultiIndex)) or
+                (not self.df.index.is_monotonic_increasing)):
+                #station records are not contiguous, only a name lookup is possible
+                self._station_slices = {}
+            else:
+                bounds = station_bounds(self.df.index)
+                names = self.df.index.get_level_values('name')[bounds[:-1]]
+                self._station_slices = {name: slice(start, stop) for name, start, stop in zip(names, bounds[:-1], bounds[1:])}
+            self._station_slices_index = self.df.index
+            
+        return self._station_slices
+        
+    def _subset_on_stations(self, data, stationnames):
+        """
+        Select the records of the stations in stationnames from data, a dataframe or
+        series with the index of Dataset.df. If the station slices are available
+        the station blocks are taken by position, else the names are scanned.
+        The order of the records is kept.
+        """
+        station_slices = self.get_station_slices()
+        if bool(station_slices) and (data.index is self.df.index):
+            #take the station blocks by position instead of scanning all names
+            selected_slices = sorted([station_slices[name] for name in set(stationnames) if name in station_slices],
+                                     key=lambda station_slice: station_slice.start)
+            positions = [np.arange(station_slice.start, station_slice.stop) for station_slice in selected_slices]
+            return data.iloc[np.concatenate([np.array([], dtype=int)] + positions)]
+        else:
+            return data.loc[data.index.get_level_values(level='name').isin(set(stationnames))]
+        
+    def _subset_on_datetime(self, timeinstance):
+        """
+        Select the records of all stations at timeinstance from Dataset.df, indexed
+        by name. On the sorted dataframe the timeinstance is looked up by a binary
+        search in each station block, instead of scanning the full datetime level.
+        """
+        station_slices = self.get_station_slices()
+        if bool(station_slices) and isinstance(timeinstance, datetime) and self.df.index.is_unique:
+            datetime_level_idx = self.df.index.names.index('datetime')
+            datetime_level = self.df.index.levels[datetime_level_idx]
+            if datetime_level.is_monotonic_increasing and (timeinstance in datetime_level):
+                #the datetime codes are sorted within each station block
+                code = datetime_level.get_loc(timeinstance)
+                codes = self.df.index.codes[datetime_level_idx]
+                positions = []
+                for station_slice in station_slices.values():
+                    position = station_slice.start + np.searchsorted(codes[station_slice], code)
+                    if (position < station_slice.stop) and (codes[position] == code):
+                        positions.append(position)
+                return self.df.iloc[positions].droplevel('datetime')
+        
+        return self.df.xs(timeinstance, level='datetime')
         
     def get_station(self, stationname):
         
@@ -94,7 +162,11 @@ class Dataset:
         logger.info(f'Extract {stationname} from dataset.')
         
         try:
-            sta_df = self.df.xs(stationname, level='name')
+            station_slices = self.get_station_slices()
+            if bool(station_slices):
+                sta_df = self.df.iloc[station_slices[stationname]].droplevel('name')
+            else:
+                sta_df = self.df.xs(stationname, level='name')
             sta_meta_series = self.metadf.loc[stationname]
         except KeyError:
             logger.warning(f'{stationname} not found in the dataset.')
@@ -136,28 +208,29 @@ class Dataset:
             print("This dataset is empty!")
             # logger.error('The dataset is empty!')
         else: 
-            print('\n','--------  General ---------', '\n')
-            print(f' .... ')
-            
+            info_lines = ['\n --------  General --------- \n',
+                          ' .... ']
             
             
-            print('\n','--------  Observations ---------', '\n')
-            starttimestr = datetime.strftime(min(self.df.index.get_level_values(level='datetime')),
-                                             Settings.print_fmt_datetime)
-            endtimestr = datetime.strftime(max(self.df.index.get_level_values(level='datetime')), Settings.print_fmt_datetime)
+            info_lines.append('\n --------  Observations --------- \n')
+            datetimes = self.df.index.get_level_values(level='datetime')
+            starttimestr = datetimes.min().strftime(Settings.print_fmt_datetime)
+            endtimestr = datetimes.max().strftime(Settings.print_fmt_datetime)
             
             stations_available = list(self.df.index.get_level_values(level='name').unique())
-            print(f'Observations found for period: {starttimestr} --> {endtimestr}')
+            info_lines.append(f'Observations found for period: {starttimestr} --> {endtimestr}')
             # logger.debug(f'Observations found for period: {starttimestr} --> {endtimestr}')
-            print(f'Following stations are in dataset: {stations_available}')
+            info_lines.append(f'Following stations are in dataset: {stations_available}')
             # logger.debug(f'Following stations are in dataset: {stations_available}')
             
-            print('\n', '--------  Outliers ---------', '\n')
-            print(f'There are {self.outliersdf.shape[0]} flagged observations found in total. They occure in these stations: {list(self.outliersdf.index.get_level_values("name").unique())}')
+            info_lines.append('\n --------  Outliers --------- \n')
+            info_lines.append(f'There are {self.outliersdf.shape[0]} flagged observations found in total. They occure in these stations: {list(self.outliersdf.index.get_level_values("name").unique())}')
             
-            print('\n', '--------  Gaps ---------', '\n')
-            print(f'There are {self.gapsdf.shape[0]} gaps found in total. They occure in these stations: {list(self.gapsdf.index.unique())}')
+            info_lines.append('\n --------  Gaps --------- \n')
+            info_lines.append(f'There are {self.gapsdf.shape[0]} gaps found in total. They occure in these stations: {list(self.gapsdf.index.unique())}')
             
+            #print all info at once
+            print('\n'.join(info_lines))
             
             
         
@@ -192,17 +265,29 @@ class Dataset:
         """
         logger.info(f'Make {variable}-timeseries plot for {stationnames}')
         
+        if self.df.empty:
+            logger.warning('The dataset is empty, no timeseries plot can be made.')
+            print('The dataset is empty, no timeseries plot can be made.')
+            return None
+        
         default_settings=Settings.plot_settings['time_series']
         
         
         #Subset on obseravtion type
         plotdf = self.df[variable]
         
-        #Unstack dataframe on name
-        plotdf = plotdf.unstack('name')
-        
         #Subset on stationnames
-        if not isinstance(stationnames, type(None)):
+        if isinstance(stationnames, type(None)):
+            #Unstack dataframe on name
+            plotdf = plotdf.unstack('name')
+        else:
+            #Only unstack the selected stations, on the timestamps of the full dataset
+            all_datetimes = plotdf.index.remove_unused_levels().levels[plotdf.index.names.index('datetime')]
+            if isinstance(stationnames, str):
+                plotdf = self._subset_on_stations(plotdf, [stationnames])
+            else:
+                plotdf = self._subset_on_stations(plotdf, stationnames)
+            plotdf = plotdf.unstack('name').reindex(all_datetimes)
             plotdf = plotdf[stationnames]
        
         #Subset on start and endtime
@@ -274,6 +359,11 @@ class Dataset:
         
         
         
+        if self.df.empty:
+            logger.warning('The dataset is empty, no geo plot can be made.')
+            print('The dataset is empty, no geo plot can be made.')
+            return None
+        
         #Load default plot settings
         default_settings=Settings.plot_settings['spatial_geo']
         
@@ -284,7 +374,7 @@ class Dataset:
         logger.info(f'Make {variable}-geo plot at {timeinstance}')
         
         #subset to timeinstance
-        plotdf = self.df.xs(timeinstance, level='datetime')
+        plotdf = self._subset_on_datetime(timeinstance)
         
         #merge metadata
         plotdf = plotdf.merge(self.metadf, how='left',
@@ -294,8 +384,9 @@ class Dataset:
         plotdf = plotdf[[variable, 'geometry']]
         
         #Subset to the stations that have coordinates
-        ignored_stations = plotdf[plotdf['geometry'].isnull()]
-        plotdf = plotdf[~plotdf['geometry'].isnull()]
+        missing_geometry = plotdf['geometry'].isnull().to_numpy()
+        ignored_stations = plotdf[missing_geometry]
+        plotdf = plotdf[~missing_geometry]
         if plotdf.empty:
             logger.error(f'No coordinate data found, geoplot can not be made. Plotdf: {plotdf}')
             print(f'No coordinate data found, geoplot can not be made. Plotdf: {plotdf}')
@@ -394,7 +485,7 @@ class Dataset:
         
         
         #make column ordering
-        df_columns = observation_types.copy() #observations
+        df_columns = list(observation_types) #observations
         df_columns.extend(location_info) #metadata
         qc_columns = [col for col in outliersdf if col.endswith('_label')] #add qc labels
         df_columns.extend(qc_columns)
@@ -404,26 +495,26 @@ class Dataset:
         
     
         
-        #unstack observations and merge with metadf
-        df = self.df 
-        df[qc_columns] = 'ok'
-        df = pd.concat([df, outliersdf])
+        #find observation type that are not present (neither in the observations nor in the outliers)
+        ignore_obstypes = [col for col in observation_types if self.df[col].isnull().all() and
+                           ((not col in outliersdf.columns) or outliersdf[col].isnull().all())]
+        
+        logger.debug(f'Skip quality labels for obstypes: {ignore_obstypes}.')
+        df_columns = [col for col in df_columns if col not in ignore_obstypes]
+        
+        #unstack observations and merge with metadf (without altering self.df), 
+        #only the columns that are written are combined
+        df = self.df[[col for col in observation_types if col not in ignore_obstypes]]
+        df = df.assign(**{col: 'ok' for col in qc_columns})
+        df = pd.concat([df, outliersdf[[col for col in outliersdf.columns if col in df_columns]]])
         df = df.reset_index()
         
-        metadf = self.metadf.reset_index()
+        metadf = self.metadf[[col for col in location_info if col in self.metadf.columns]].reset_index()
         df = df.merge(metadf, how='left', on='name')
         
-        #sort and subset columns
+        #sort columns
         df = df[df_columns]
         
-                
-        #find observation type that are not present
-        ignore_obstypes = [col for col in observation_types if df[col].isnull().all()]
-        
-        df = df.drop(columns=ignore_obstypes)
-        
-        logger.debug(f'Skip quality labels for obstypes: {ignore_obstypes}.')
-        
         df = df.sort_values(['name', 'datetime'])
        
         #make filename
@@ -442,7 +533,8 @@ class Dataset:
         df.to_csv(path_or_buf=filepath,
                        sep=';',
                        na_rep='NaN',
-                       index=True)        
+                       index=True,
+                       chunksize=200000)        
         
     
 
@@ -498,11 +590,11 @@ class Dataset:
            print('Applying the repetitions-check on all stations.')
            logger.info('Applying repetitions check on the full dataset')
            
-           checked_series, outl_df = repetitions_check(input_series=self.df[obstype],
-                                                     obstype=obstype)
+           _, outl_df = repetitions_check(input_series=self.df[obstype],
+                                        obstype=obstype)
            
            #update the dataset and outliers
-           self.df[obstype] = checked_series
+           self.df.loc[outl_df.index, obstype] = np.nan
            self.update_outliersdf(outl_df)
          
             
@@ -510,11 +602,11 @@ class Dataset:
             print('Applying the gross-value-check on all stations.')
             logger.info('Applying gross value check on the full dataset')
     
-            checked_series, outl_df = gross_value_check(input_series = self.df[obstype],
-                                                        obstype=obstype)
+            _, outl_df = gross_value_check(input_series = self.df[obstype],
+                                           obstype=obstype)
             
             #update the dataset and outliers
-            self.df[obstype] = checked_series
+            self.df.loc[outl_df.index, obstype] = np.nan
             self.update_outliersdf(outl_df)
             
             
@@ -522,35 +614,35 @@ class Dataset:
             print('Applying the persistance-check on all stations.')
             logger.info('Applying persistance check on the full dataset')
           
-            checked_series, outl_df = persistance_check(station_frequencies=self.metadf['dataset_resolution'], input_series=self.df[obstype],
-                                                        obstype=obstype)
+            _, outl_df = persistance_check(station_frequencies=self.metadf['dataset_resolution'], input_series=self.df[obstype],
+                                           obstype=obstype)
 
             #update the dataset and outliers
-            self.df[obstype] = checked_series
+            self.df.loc[outl_df.index, obstype] = np.nan
             self.update_outliersdf(outl_df)
             
         if step:
             print('Applying the step-check on all stations.')
             logger.info('Applying step-check on the full dataset')
            
-            checked_series, outl_df = step_check(input_series=self.df[obstype],
-                                                 obstype=obstype)
+            _, outl_df = step_check(input_series=self.df[obstype],
+                                    obstype=obstype)
                                                       
             
             #update the dataset and outliers
-            self.df[obstype] = checked_series
+            self.df.loc[outl_df.index, obstype] = np.nan
             self.update_outliersdf(outl_df)
             
         if window_variation:
             print('Applying the window variation-check on all stations.')
             logger.info('Applying window variation-check on the full dataset')
            
-            checked_series, outl_df = window_variation_check(station_frequencies=self.metadf['dataset_resolution'], input_series=self.df[obstype],
-                                                 obstype=obstype)
+            _, outl_df = window_variation_check(station_frequencies=self.metadf['dataset_resolution'], input_series=self.df[obstype],
+                                                obstype=obstype)
                                                       
             
             #update the dataset and outliers
-            self.df[obstype] = checked_series
+            self.df.loc[outl_df.index, obstype] = np.nan
             self.update_outliersdf(outl_df)
         
         self.outliersdf = self.outliersdf.sort_index()
@@ -622,8 +714,10 @@ class Dataset:
             if isinstance(stationnames, str):
                 stationnames = [stationnames]
             
-            qc_labels_df = self.get_final_qc_labels().loc[self.get_final_qc_labels().index.get_level_values(level='name').isin(stationnames)]
-            df = self.df.loc[self.df.index.get_level_values(level='name').isin(stationnames)]
+            qc_labels_df = self.get_final_qc_labels()
+            qc_labels_df = qc_labels_df.loc[qc_labels_df.index.get_level_values(level='name').isin(stationnames)]
+            
+            df = self._subset_on_stations(self.df, stationnames)
             outliersdf = outliersdf.loc[outliersdf.index.get_level_values(level='name').isin(stationnames)]
         
         
@@ -682,6 +776,11 @@ class Dataset:
         #Fix labels
         self.outliersdf[previous_performed_checks_columns] = self.outliersdf[previous_performed_checks_columns].fillna(value='ok')
         self.outliersdf[new_performed_checks_columns] = self.outliersdf[new_performed_checks_columns].fillna(value='not checked')
+        
+        #Store the labels as categoricals (a small integer code per record)
+        label_columns = previous_performed_checks_columns + new_performed_checks_columns
+        label_dtype = get_qc_label_dtype(observed_labels=get_observed_qc_labels(self.outliersdf, label_columns))
+        self.outliersdf[label_columns] = self.outliersdf[label_columns].astype(label_dtype)
     
     def get_final_qc_labels(self):
         """
@@ -759,7 +858,9 @@ class Dataset:
         # Read observations into pandas dataframe
         df, template = import_data_from_csv(input_file = Settings.input_data_file,
                                   file_csv_template=Settings.input_csv_template,
-                                  template_list = Settings.template_list)
+                                  template_list = Settings.template_list,
+                                  fast_io=Settings.fast_io,
+                                  cache_folder=Settings.cache_folder)
         
         logger.debug(f'Data from {Settings.input_data_file} imported to dataframe.')
 
@@ -790,7 +891,7 @@ class Dataset:
         
         
         #update dataset object
-        self.data_template = pd.DataFrame().from_dict(template)
+        self.data_template = pd.DataFrame.from_dict(template)
         
 
         #convert dataframe to multiindex (datetime - name)
@@ -843,23 +944,18 @@ class Dataset:
         
         
         #Make data template
-        self.data_template =  pd.DataFrame().from_dict(template_to_package_space(Settings.vlinder_db_obs_template))
+        self.data_template =  pd.DataFrame.from_dict(compile_template(Settings.vlinder_db_obs_template)[0])
         
-        # if coarsen_timeres:
-        #     df = coarsen_time_resolution(df=df,
-        #                                   freq=Settings.target_time_res,
-        #                                   method=Settings.resample_method)
-            
         #convert dataframe to multiindex (datetime - name)
         df = df.set_index(['name', df.index])
         df = df.sort_index()
         
         #If an ID has changed or not present in the metadatafile, the stationname and metadata is Nan
         #These observations will be removed
-        unknown_obs = df[df.index.get_level_values('name').isnull()]
-        if not unknown_obs.empty:
+        unknown_name = df.index.get_level_values('name').isnull()
+        if unknown_name.any():
             logger.warning('There is an unknown station in the dataset (probaply due to an ID that is not present in the metadata file). This will be removed.')
-            df = df[~df.index.get_level_values('name').isnull()]
+            df = df[~unknown_name]
         
         self.update_dataset_by_df(dataframe=df, coarsen_timeres=coarsen_timeres)
         
@@ -895,7 +991,7 @@ class Dataset:
         logger.info(f'Updating dataset by dataframe with shape: {dataframe.shape}.')
         
         #Create dataframe with fixed number and order of observational columns
-        df = dataframe.reindex(columns = observation_types)
+        df = dataframe.reindex(columns = list(observation_types))
         self.df = df
         
         #create metadataframe with fixed number and order of columns
@@ -910,7 +1006,9 @@ class Dataset:
         self.metadf['assumed_import_frequency'] = get_freqency_series(self.df)
         
         #TODO: How to implement the choise to apply QC on import freq or on coarsened frequency
-        self.df = df.sort_index()
+        if not df.index.is_monotonic_increasing:
+            df = df.sort_index()
+        self.df = df
         
         self.df, missing_outl_df, self.gapsdf, station_freqs= missing_timestamp_and_gap_check(df=self.df)
         self.df, dup_outl_df = duplicate_timestamp_check(df=self.df)
@@ -929,6 +1027,8 @@ class Dataset:
             
         #get LCZ values (if coords are availible)
         self.metadf =  get_lcz(self.metadf)
+        #the lcz labels repeat over the stations, so store them as categorical (like name and network)
+        self.metadf['lcz'] = self.metadf['lcz'].astype('category')
         
 
 def metadf_to_gdf(df, crs=4326):
@@ -953,8 +1053,9 @@ def metadf_to_gdf(df, crs=4326):
     """
     
     # only conver to points if coordinates are present
-    coordsdf = df[(~df['lat'].isnull()) & (~df['lon'].isnull())]
-    missing_coords_df =  df[(df['lat'].isnull()) | (df['lon'].isnull())]
+    missing_coords = (df['lat'].isnull() | df['lon'].isnull()).to_numpy()
+    coordsdf = df[~missing_coords]
+    missing_coords_df =  df[missing_coords]
     
     geodf = gpd.GeoDataFrame(coordsdf,
                               geometry=gpd.points_from_xy(coordsdf.lon,
@@ -997,7 +1098,6 @@ def get_lcz(metadf):
     
 
     
-    geo_templates = Settings.geo_datasets_templates
     lcz_file = Settings.geo_lcz_file
     
     if isinstance(lcz_file, type(None)):
@@ -1007,14 +1107,10 @@ def get_lcz(metadf):
         metadf['lcz'] = 'Unkown lcz file'
         return metadf
     
-    lcz_templates = [geo_templ for geo_templ in geo_templates if geo_templ['usage']=='LCZ']
+    assert not isinstance(Settings.lcz_template, type(None)), 'More (or no) lcz template found!'
     
-    assert len(lcz_templates)==1, 'More (or no) lcz template found!'
-    
-    lcz_template = lcz_templates[0]
-    
-    human_mapper = {num: lcz_template['covers'][num]['cover_name'] 
-                    for num in lcz_template['covers'].keys()}
+    lcz_template = Settings.lcz_template
+    human_mapper = Settings.lcz_human_mapper
     
 
    
@@ -1066,30 +1162,154 @@ def datetime_subsetting(df, starttime, endtime):
 
     """
     
-    stand_format = '%Y-%m-%d %H:%M:%S'
+    #The bounds are found by a binary search on the (sorted) datetimeindex. As
+    #before (with string slicing), the bounds are taken on a resolution of 
+    #seconds and the wall time of the bounds is used in the timezone of the index.
+    def _to_index_timestamp(dt):
+        dt = pd.Timestamp(dt).floor('s')
+        if dt.tzinfo is not None:
+            dt = dt.tz_localize(None)
+        if df.index.tz is not None:
+            dt = dt.tz_localize(df.index.tz)
+        return dt
     
-    if isinstance(starttime, type(None)):
-        startstring = None #will select from the beginning of the df
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index()
+    
+    if starttime is None:
+        startidx = 0 #will select from the beginning of the df
+    else:
+        startidx = df.index.searchsorted(_to_index_timestamp(starttime), side='left')
+    if endtime is None:
+        endidx = df.shape[0]
     else:
-        startstring = starttime.strftime(stand_format)
-    if isinstance(endtime, type(None)):
-        endstring = None
-    else: 
-        endstring = endtime.strftime(stand_format)
+        endidx = df.index.searchsorted(_to_index_timestamp(endtime) + pd.Timedelta(seconds=1), side='left')
 
-    return df[startstring: endstring]
+    return df.iloc[startidx:endidx]
 
 
 
 
+def get_qc_label_dtype(observed_labels=None):
+    """
+    The categorical dtype used to store the QC labels in the outliersdf. The
+    categories are 'ok', 'not checked' and the outlier flags of all the checks.
+    
+    Observed labels that are none of these (i.g. a custom flag) are added as extra 
+    categories after the known labels, so the cast does not turn them into NaN.
+
+    Parameters
+    ----------
+    observed_labels : iterable, optional
+        The labels that are present in the data. The default is None.
+
+    Returns
+    -------
+    pandas.CategoricalDtype
+        The (unordered) categorical dtype of the QC labels.
+
+    """
+    labels = ['ok', 'not checked']
+    labels.extend([info['outlier_flag'] for info in Settings.qc_checks_info.values()])
+    labels = list(dict.fromkeys(labels))
+    
+    if not isinstance(observed_labels, type(None)):
+        known_labels = set(labels)
+        unknown_labels = [label for label in dict.fromkeys(observed_labels)
+                          if (not label in known_labels) and (not pd.isnull(label))]
+        if bool(unknown_labels):
+            logger.warning(f'Unknown QC labels {unknown_labels} are found, they are not used for the final label.')
+            labels.extend(unknown_labels)
+    
+    return pd.CategoricalDtype(categories=labels, ordered=False)
+
+
+def get_observed_qc_labels(df, label_columns):
+    """
+    Get the labels that are present in the QC label columns of a dataframe. For
+    categorical columns, the categories are returned.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        A dataframe with QC label columns (i.g. the outliersdf).
+    label_columns : list
+        The names of the QC label columns.
+
+    Returns
+    -------
+    list
+        The labels of all the columns (may contain duplicates).
+
+    """
+    labels = []
+    for column in label_columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            labels.extend(df[column].cat.categories)
+        else:
+            labels.extend(pd.unique(df[column]))
+    return labels
+
+
+#The lookup tables of the final labels only depend on the qc checks info, they
+#are made once per (outlier flag, numeric flag) combination.
+_final_label_tables = {}
+
+def get_final_label_tables():
+    """
+    Get the lookup tables to make the final qc label of a record. Each outlier label 
+    is a bit (in order of the numeric flags), 'ok', 'not checked' and missing labels 
+    set no bit. The final label of combined bits is 'ok' if no bit is set, else the 
+    outlier label of the lowest set bit.
+    
+    The returned arrays are shared, so they should not be modified.
+
+    Returns
+    -------
+    bits_by_code : numpy.ndarray
+        The bit per category code of the qc label dtype, the last element (code -1)
+        is for missing labels. The dtype is the smallest unsigned integer that holds all bits.
+    final_label_by_bits : numpy.ndarray
+        The final label (object) per combination of bits.
+
+    """
+    key = tuple((info['outlier_flag'], info['numeric_flag']) for info in Settings.qc_checks_info.values())
+    if key in _final_label_tables:
+        return _final_label_tables[key]
+    
+    # Construct bit mapper: one bit per outlier label (in order of the numeric flags),
+    # 'ok', 'not checked' and missing labels set no bit.
+    outlier_labels = [info['outlier_flag'] for info in sorted(Settings.qc_checks_info.values(),
+                                                              key=lambda info: info['numeric_flag'])]
+    outlier_labels = list(dict.fromkeys(outlier_labels))
+    labels_to_bit_mapper = {label: 1 << i for i, label in enumerate(outlier_labels)}
+    
+    #bit per category code of the labels (code -1, a missing label, maps on the last element),
+    #in the smallest unsigned integer that holds all bits (uint8 for up to 8 outlier labels)
+    bits_dtype = np.min_scalar_type((1 << len(outlier_labels)) - 1)
+    bits_by_code = np.array([labels_to_bit_mapper.get(label, 0) for label in get_qc_label_dtype().categories] + [0],
+                            dtype=bits_dtype)
+    
+    #final label per combination of bits: 'ok' if no bit is set, else the outlier label 
+    #of the lowest set bit
+    final_label_by_bits = np.empty(1 << len(outlier_labels), dtype=object)
+    final_label_by_bits[0] = 'ok'
+    bitmasks = np.arange(final_label_by_bits.shape[0])
+    for i, label in reversed(list(enumerate(outlier_labels))):
+        final_label_by_bits[(bitmasks >> i) & 1 == 1] = label
+    _final_label_tables[key] = (bits_by_code, final_label_by_bits)
+    return _final_label_tables[key]
+
+
 def add_final_label_to_outliersdf(outliersdf, gapsdf, data_res_series):
     """
     V3
         This function creates a final label based on de individual qc labels. The final label will be that of the individual qc-label
         which rejected the obseration.
        
-        This functions converts labels to numeric values, algebra to get final label, and inversly 
-        convert to labels. This is faster than looping over the rows.
+        This functions converts labels to bits (one per outlier label), combines them with a bitwise or
+        and inversly converts the combined bits to the label of the lowest set bit (the outlier 
+        label with the lowest numeric flag). This is faster than looping over the rows.
 
         Parameters
         ----------
@@ -1113,45 +1333,47 @@ def add_final_label_to_outliersdf(outliersdf, gapsdf, data_res_series):
     gaps_exploded = gaps_to_outlier_format(gapsdf, data_res_series)
     outliersdf = pd.concat([outliersdf, gaps_exploded])
     #fill Nan's by 'ok'
-    if Settings.qc_checks_info['gaps_finder']['label_columnname'] in outliersdf.columns:
-        outliersdf[Settings.qc_checks_info['gaps_finder']['label_columnname']].fillna(value='ok',
-                                                                                      inplace=True)
+    gap_label_column = Settings.qc_checks_info['gaps_finder']['label_columnname']
+    if gap_label_column in outliersdf.columns:
+        outliersdf[gap_label_column] = outliersdf[gap_label_column].fillna(value='ok')
+    
+    #the concat with the (string) gap labels drops the categorical labels, so cast all labels once
+    qc_label_columns = [column for column in outliersdf.columns if column.endswith('_label')]
+    label_dtype = get_qc_label_dtype(observed_labels=get_observed_qc_labels(outliersdf, qc_label_columns))
+    outliersdf[qc_label_columns] = outliersdf[qc_label_columns].astype(label_dtype)
     
     # order columns
-    labels_columns = [column for column in outliersdf.columns if not column in observation_types]
-    checked_obstypes = [obstype for obstype in observation_types if any([qc_column.startswith(obstype+'_') for qc_column in labels_columns])]
-    columns_on_record_lvl = [info['label_columnname'] for checkname, info in Settings.qc_checks_info.items() if info['apply_on'] == 'record']
+    checked_obstypes = [obstype for obstype in observation_types if any([qc_column.startswith(obstype+'_') for qc_column in qc_label_columns])]
+    columns_on_record_lvl = [info['label_columnname'] for checkname, info in Settings.qc_checks_info.items() 
+                             if (info['apply_on'] == 'record') and (info['label_columnname'] in qc_label_columns)]
    
     
-    # Construct numeric mapper
-    labels_to_numeric_mapper = {info['outlier_flag']:info['numeric_flag'] for info in Settings.qc_checks_info.values()}
-    # add 'ok' and 'not checked' labels
-    labels_to_numeric_mapper['ok'] = 0
-    labels_to_numeric_mapper['not checked'] = np.nan
-    #invert numeric mapper
-    inv_label_to_num = {v: k for k, v in labels_to_numeric_mapper.items()}
+    bits_by_code, final_label_by_bits = get_final_label_tables()
+    #unknown labels (extra categories after the known labels) set no bit
+    num_unknown_labels = len(label_dtype.categories) - (bits_by_code.shape[0] - 1)
+    if num_unknown_labels > 0:
+        bits_by_code = np.concatenate([bits_by_code, np.zeros(num_unknown_labels, dtype=bits_by_code.dtype)])
     
+    #get label bits (records x label columns) from the category codes, filled in one buffer
+    #so each label column is converted once
+    bits_qc = np.empty((outliersdf.shape[0], len(qc_label_columns)), dtype=bits_by_code.dtype)
+    for i, column in enumerate(qc_label_columns):
+        bits_qc[:, i] = bits_by_code[outliersdf[column].cat.codes.to_numpy()]
+    column_positions = {column: i for i, column in enumerate(qc_label_columns)}
+    
+    #qc labels that are applicable on all obstypes are combined once
+    record_lvl_bits = np.bitwise_or.reduce(bits_qc[:, [column_positions[column] for column in columns_on_record_lvl]],
+                                           axis=1)
     
     #generete final label per obstype
     for obstype in checked_obstypes:
         # logger.debug(f'Generating final QC labels for {obstype}.')
-        #Get qc column namse specific for this obstype
-        specific_columns = [col for col in labels_columns if col.startswith(obstype+'_')]
-        #add qc labels that are applicable on all obstypes
-        specific_columns.extend(columns_on_record_lvl)
-        
-        #Drop columns that are not present
-        specific_columns = [colmn for colmn in specific_columns if colmn in outliersdf.columns]
-        
+        #Get positions of the qc columns specific for this obstype
+        specific_positions = [column_positions[column] for column in qc_label_columns if column.startswith(obstype+'_')]
         
-        
-        #get labels dataframe
-        qc_df = outliersdf[specific_columns]
-        num_qc_df = pd.DataFrame()
-        num_qc_df = qc_df.applymap(labels_to_numeric_mapper.get )
-       
+        combined_bits = np.bitwise_or.reduce(bits_qc[:, specific_positions], axis=1) | record_lvl_bits
     
-        outliersdf[obstype+'_final_label'] = num_qc_df.sum(axis=1, skipna=True).map(inv_label_to_num)
+        outliersdf[obstype+'_final_label'] = final_label_by_bits[combined_bits]
        
    
     return outliersdf
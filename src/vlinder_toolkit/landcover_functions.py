@@ -5,9 +5,12 @@ Created on Wed Oct 19 11:28:36 2022
 
 @author: thoverga
 """
+import os
 import pandas as pd
+import numpy as np
 # from shapely.geometry import Point
 import rasterstats
+import rasterio
 
 
     
@@ -15,25 +18,64 @@ import rasterstats
 # geodataset functions
 # =============================================================================
 
+#The extracted raster values are cached per location:
+# (geotiff_location, modification time, band, interpolate, x, y) --> raster value
+#The cache is bounded, the oldest entries are dropped first.
+_point_query_cache = {}
+_point_query_cache_maxsize = 4096
+
 
 
 
 def geotiff_point_extraction(geodf, geotiff_location, geotiff_crs, class_to_human_mapper,
                              band=1, interpolate='nearest'):
 
-    coords_geodf = geodf[~geodf['geometry'].isnull()]
-    missing_coords_geodf = geodf[geodf['geometry'].isnull()]
+    missing_geometry = geodf['geometry'].isnull().to_numpy()
+    coords_geodf = geodf[~missing_geometry]
+    missing_coords_geodf = geodf[missing_geometry]
     
 
 
-    #extract raster value for the point object
-    coords_geodf['_numeric_label'] = rasterstats.point_query(vectors=coords_geodf['geometry'],
-                                           raster=geotiff_location,
-                                           band=band,
-                                           nodata=None,
-                                           affine=None,
-                                           interpolate=interpolate, #nearest or bilinear (beliniear --> no direct mapping to a class possible)
-                                           geojson_out=False)
+    #Only extract the raster values for locations that are not in the cache
+    #(a replaced geotiff has another modification time, so it is not served from the cache)
+    geotiff_mtime = os.stat(geotiff_location).st_mtime_ns
+    cache_keys = [(geotiff_location, geotiff_mtime, band, interpolate, round(point.x, 6), round(point.y, 6))
+                  for point in coords_geodf['geometry']]
+    values_by_key = {}
+    points_to_query = {}
+    for key, point in zip(cache_keys, coords_geodf['geometry']):
+        if key in _point_query_cache:
+            values_by_key[key] = _point_query_cache[key]
+        elif key not in points_to_query:
+            points_to_query[key] = point
+    
+    if bool(points_to_query):
+        if interpolate == 'nearest':
+            #open the geotiff once and sample the pixel of each point
+            with rasterio.open(geotiff_location) as src:
+                samples = src.sample([(point.x, point.y) for point in points_to_query.values()],
+                                     indexes=band,
+                                     masked=True)
+                values = [None if np.ma.is_masked(sample[0]) else sample[0].item() for sample in samples]
+        else:
+            #extract raster value for the point objects
+            values = rasterstats.point_query(vectors=list(points_to_query.values()),
+                                             raster=geotiff_location,
+                                             band=band,
+                                             nodata=None,
+                                             affine=None,
+                                             interpolate=interpolate, #bilinear --> no direct mapping to a class possible
+                                             geojson_out=False)
+        queried_values = dict(zip(points_to_query.keys(), values))
+        values_by_key.update(queried_values)
+        _point_query_cache.update(queried_values)
+        
+        #drop the oldest entries if the cache is too large
+        num_dropped = len(_point_query_cache) - _point_query_cache_maxsize
+        for key in list(_point_query_cache.keys())[:max(num_dropped, 0)]:
+            del _point_query_cache[key]
+    
+    coords_geodf['_numeric_label'] = [values_by_key[key] for key in cache_keys]
     coords_geodf['_human_label'] = coords_geodf['_numeric_label'].map(class_to_human_mapper)
     missing_coords_geodf['_human_label'] = 'Unknown'
     
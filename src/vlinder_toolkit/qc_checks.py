@@ -19,6 +19,12 @@ import logging
 # from .settings import Settings
 from .settings_files.qc_settings import check_settings, checks_info
 
+try:
+    from numba import njit
+    numba_available = True
+except ImportError:
+    numba_available = False
+
 
 
 logger = logging.getLogger(__name__)
@@ -101,23 +107,280 @@ def make_outlier_df_for_check(station_dt_list, values_in_dict, flagcolumnname, f
 
 
 
+# =============================================================================
+# Compiled helpers
+# =============================================================================
+
+def station_bounds(index):
+    """
+    Get the positions where the stations start in a (name, datetime) multiindex
+    that is sorted on name. The last element is the length of the index, so
+    the records of station i are in bounds[i]:bounds[i+1].
+    """
+    name_codes = np.asarray(index.codes[index.names.index('name')])
+    starts = np.flatnonzero(name_codes[1:] != name_codes[:-1]) + 1
+    return np.concatenate([[0], starts, [len(name_codes)]]).astype('int64')
+
+def _run_length_flags_loop(values, bounds, max_rep):
+    """
+    Single scan over the values of all stations. All values of a run of equal
+    consecutive values (within a station) that is longer than max_rep are flagged.
+    """
+    flags = np.zeros(values.shape[0], dtype=np.bool_)
+    for station in range(bounds.shape[0] - 1):
+        start, stop = bounds[station], bounds[station + 1]
+        run_start = start
+        for i in range(start + 1, stop + 1):
+            if i == stop or values[i] != values[i - 1]:
+                if i - run_start > max_rep:
+                    flags[run_start:i] = True
+                run_start = i
+    return flags
+
+def _run_length_flags_numpy(values, bounds, max_rep):
+    """ Vectorized version of _run_length_flags_loop, used when numba is not installed."""
+    if values.shape[0] == 0:
+        return np.zeros(0, dtype=bool)
+    new_run = np.ones(values.shape[0], dtype=bool)
+    new_run[1:] = values[1:] != values[:-1]
+    new_run[bounds[:-1]] = True
+    run_id = np.cumsum(new_run) - 1
+    return np.bincount(run_id)[run_id] > max_rep
+
+def _step_flags_loop(values, times_ns, bounds, max_increase, max_decrease):
+    """
+    Single scan over the values of all stations. A value is flagged if the
+    change with respect to the previous record of that station exceeds the
+    allowed increase or decrease for the time between both records.
+    """
+    flags = np.zeros(values.shape[0], dtype=np.bool_)
+    for station in range(bounds.shape[0] - 1):
+        for i in range(bounds[station] + 1, bounds[station + 1]):
+            step = values[i] - values[i - 1]
+            seconds = 1e-9 * (times_ns[i] - times_ns[i - 1])
+            if step > max_increase * seconds or step < max_decrease * seconds:
+                flags[i] = True
+    return flags
+
+def _step_flags_numpy(values, times_ns, bounds, max_increase, max_decrease):
+    """ Vectorized version of _step_flags_loop, used when numba is not installed."""
+    flags = np.zeros(values.shape[0], dtype=bool)
+    if values.shape[0] > 1:
+        step = np.diff(values)
+        seconds = 1e-9 * np.diff(times_ns)
+        flags[1:] = (step > max_increase * seconds) | (step < max_decrease * seconds)
+        flags[bounds[:-1]] = False #first record of each station
+    return flags
+
+def _window_members_flags_loop(times_ns, valid, centers, bounds, half_window_ns, freq_ns):
+    """
+    Single scan over the records of all stations. For each flagged center, all
+    valid records of that station that lie on the (station frequency) grid of
+    the window around the center are flagged. The half window and frequency are
+    given per station.
+    """
+    flags = np.zeros(times_ns.shape[0], dtype=np.bool_)
+    for station in range(bounds.shape[0] - 1):
+        start, stop = bounds[station], bounds[station + 1]
+        for i in range(start, stop):
+            if not centers[i]:
+                continue
+            window_start = times_ns[i] - half_window_ns[station]
+            window_end = times_ns[i] + half_window_ns[station]
+            j = i
+            while j > start and times_ns[j - 1] >= window_start:
+                j -= 1
+            while j < stop and times_ns[j] <= window_end:
+                if valid[j] and (times_ns[j] - window_start) % freq_ns[station] == 0:
+                    flags[j] = True
+                j += 1
+    return flags
+
+def _window_members_flags_numpy(times_ns, valid, centers, bounds, half_window_ns, freq_ns):
+    """ Version of _window_members_flags_loop with a python loop over the centers only, used when numba is not installed."""
+    flags = np.zeros(times_ns.shape[0], dtype=bool)
+    for i in np.flatnonzero(centers):
+        station = np.searchsorted(bounds, i, side='right') - 1
+        start, stop = bounds[station], bounds[station + 1]
+        window_start = times_ns[i] - half_window_ns[station]
+        window_end = times_ns[i] + half_window_ns[station]
+        first = start + np.searchsorted(times_ns[start:stop], window_start, side='left')
+        last = start + np.searchsorted(times_ns[start:stop], window_end, side='right')
+        on_grid = (times_ns[first:last] - window_start) % freq_ns[station] == 0
+        flags[first:last] |= valid[first:last] & on_grid
+    return flags
+
+def _persistance_centers_loop(values, times_ns, bounds, half_window_ns, min_members):
+    """
+    Single scan over the records of all stations with a centered time window
+    (both sides closed) per record. A record is flagged as a center if its window
+    has at least min_members valid values and all valid values are equal.
+    """
+    flags = np.zeros(values.shape[0], dtype=np.bool_)
+    for station in range(bounds.shape[0] - 1):
+        start, stop = bounds[station], bounds[station + 1]
+        first, last = start, start
+        for i in range(start, stop):
+            while times_ns[first] < times_ns[i] - half_window_ns:
+                first += 1
+            while last < stop and times_ns[last] <= times_ns[i] + half_window_ns:
+                last += 1
+            members = 0
+            persistant = True
+            reference = np.nan
+            for j in range(first, last):
+                if np.isnan(values[j]):
+                    continue
+                if members == 0:
+                    reference = values[j]
+                elif values[j] != reference:
+                    persistant = False
+                    break
+                members += 1
+            flags[i] = persistant and members >= min_members
+    return flags
+
+def _persistance_centers_numpy(values, times_ns, bounds, half_window_ns, min_members):
+    """ Version of _persistance_centers_loop with a python loop over the windows, used when numba is not installed."""
+    flags = np.zeros(values.shape[0], dtype=bool)
+    valid = ~np.isnan(values)
+    for station in range(bounds.shape[0] - 1):
+        start, stop = bounds[station], bounds[station + 1]
+        station_times = times_ns[start:stop]
+        firsts = start + np.searchsorted(station_times, station_times - half_window_ns, side='left')
+        lasts = start + np.searchsorted(station_times, station_times + half_window_ns, side='right')
+        for i, first, last in zip(range(start, stop), firsts, lasts):
+            window = values[first:last][valid[first:last]]
+            flags[i] = (window.shape[0] >= min_members) and (window.max() == window.min())
+    return flags
+
+def _window_variation_centers_loop(values, times_ns, bounds, half_window_ns, min_members,
+                                   max_window_increase, max_window_decrease):
+    """
+    Single scan over the records of all stations with a centered time window
+    (both sides closed) per record. A record is flagged as a center if its window
+    has at least min_members valid values, starts with a valid value and the 
+    difference between the window maximum and minimum exceeds the window increase 
+    (maximum after the minimum) or decrease (maximum before the minimum) threshold.
+    """
+    flags = np.zeros(values.shape[0], dtype=np.bool_)
+    for station in range(bounds.shape[0] - 1):
+        start, stop = bounds[station], bounds[station + 1]
+        first, last = start, start
+        for i in range(start, stop):
+            while times_ns[first] < times_ns[i] - half_window_ns:
+                first += 1
+            while last < stop and times_ns[last] <= times_ns[i] + half_window_ns:
+                last += 1
+            if np.isnan(values[first]):
+                continue
+            members = 0
+            argmax, argmin = first, first
+            for j in range(first, last):
+                if np.isnan(values[j]):
+                    continue
+                members += 1
+                if values[j] > values[argmax]:
+                    argmax = j
+                if values[j] < values[argmin]:
+                    argmin = j
+            if members < min_members:
+                continue
+            variation = values[argmax] - values[argmin]
+            if variation > max_window_increase and argmax > argmin:
+                flags[i] = True
+            elif variation > max_window_decrease and argmax < argmin:
+                flags[i] = True
+    return flags
+
+def _window_variation_centers_numpy(values, times_ns, bounds, half_window_ns, min_members,
+                                    max_window_increase, max_window_decrease):
+    """ Version of _window_variation_centers_loop with a python loop over the windows, used when numba is not installed."""
+    flags = np.zeros(values.shape[0], dtype=bool)
+    valid = ~np.isnan(values)
+    for station in range(bounds.shape[0] - 1):
+        start, stop = bounds[station], bounds[station + 1]
+        station_times = times_ns[start:stop]
+        firsts = start + np.searchsorted(station_times, station_times - half_window_ns, side='left')
+        lasts = start + np.searchsorted(station_times, station_times + half_window_ns, side='right')
+        for i, first, last in zip(range(start, stop), firsts, lasts):
+            if (not valid[first]) or (np.count_nonzero(valid[first:last]) < min_members):
+                continue
+            window = values[first:last]
+            argmax, argmin = np.nanargmax(window), np.nanargmin(window)
+            variation = window[argmax] - window[argmin]
+            flags[i] = (((variation > max_window_increase) and (argmax > argmin)) or 
+                        ((variation > max_window_decrease) and (argmax < argmin)))
+    return flags
+
+if numba_available:
+    _run_length_flags = njit(cache=True, boundscheck=False)(_run_length_flags_loop)
+    _step_flags = njit(cache=True, boundscheck=False)(_step_flags_loop)
+    _window_members_flags = njit(cache=True, boundscheck=False)(_window_members_flags_loop)
+    _persistance_centers = njit(cache=True, boundscheck=False)(_persistance_centers_loop)
+    _window_variation_centers = njit(cache=True, boundscheck=False)(_window_variation_centers_loop)
+else:
+    _run_length_flags = _run_length_flags_numpy
+    _step_flags = _step_flags_numpy
+    _window_members_flags = _window_members_flags_numpy
+    _persistance_centers = _persistance_centers_numpy
+    _window_variation_centers = _window_variation_centers_numpy
+
+
+def warmup_qc():
+    """
+    Compile the numba helpers of the quality control checks (or load them from
+    the numba cache) by calling them on a small dummy array. Call this once at
+    startup to avoid the compilation time on the first apply_quality_control.
+    
+    Nothing is done if numba is not installed.
+
+    Returns
+    -------
+    None.
+
+    """
+    if not numba_available:
+        logger.debug('Numba is not installed, no QC helpers to compile.')
+        return
+    
+    dummy_values = np.arange(8, dtype='float64')
+    dummy_times = np.arange(8, dtype='int64') * 300000000000
+    dummy_bounds = np.array([0, 4, 8], dtype='int64')
+    _run_length_flags(dummy_values, dummy_bounds, 2)
+    _step_flags(dummy_values, dummy_times, dummy_bounds, 8.0/3600.0, -10.0/3600.0)
+    _window_members_flags(dummy_times, dummy_values > 0, dummy_values == 2, dummy_bounds,
+                          np.array([600000000000, 600000000000], dtype='int64'),
+                          np.array([300000000000, 300000000000], dtype='int64'))
+    _persistance_centers(dummy_values, dummy_times, dummy_bounds, 600000000000, 3)
+    _window_variation_centers(dummy_values, dummy_times, dummy_bounds, 600000000000, 3,
+                              8.0, 10.0)
+    logger.debug('QC helpers are compiled.')
+
+
+
+
 def gaps_to_outlier_format(gapsdf, dataset_res_series):
 
     checkname = 'gaps_finder'
-    exploded_gaps_df = init_outlier_multiindexdf()
-    for station, gapinfo in gapsdf.iterrows():
-        gap_timestamps=pd.date_range(start=gapinfo['start_gap'],
-                                     end=gapinfo['end_gap'],
-                                     freq=dataset_res_series.loc[station])
+    if gapsdf.empty:
+        return init_outlier_multiindexdf()
+    
+    #collect the gap timestamps of all gaps and make the frame once
+    gap_stations = []
+    gap_timestamps_list = []
+    for station, start_gap, end_gap in zip(gapsdf.index, gapsdf['start_gap'], gapsdf['end_gap']):
+        gap_timestamps = pd.date_range(start=start_gap,
+                                       end=end_gap,
+                                       freq=dataset_res_series.loc[station])
+        gap_stations.extend([station] * len(gap_timestamps))
+        gap_timestamps_list.append(gap_timestamps)
         
-        multi_idx = pd.MultiIndex.from_tuples(list(zip([station] * len(gap_timestamps),
-                                                       gap_timestamps)),
-                                              names=['name', 'datetime'])
-        exploded_gaps_df = pd.concat([exploded_gaps_df,
-                                      pd.DataFrame(data=checks_info[checkname]['outlier_flag'],
-                                                   index=multi_idx,
-    
-                                                   columns=[checks_info[checkname]['label_columnname']])])
+    multi_idx = pd.MultiIndex.from_arrays([gap_stations, gap_timestamps_list[0].append(gap_timestamps_list[1:])],
+                                          names=['name', 'datetime'])
+    exploded_gaps_df = pd.DataFrame(data=checks_info[checkname]['outlier_flag'],
+                                    index=multi_idx,
+                                    columns=[checks_info[checkname]['label_columnname']])
     return exploded_gaps_df
 
 
@@ -126,18 +389,22 @@ def gaps_to_outlier_format(gapsdf, dataset_res_series):
     
 def get_freqency_series(df):
     freqs = {}
-    for station in df.index.get_level_values(level='name').unique():
-        timestamps = df.xs(station, level='name').index
-        freqs[station] = get_likely_frequency(timestamps)
+    #positions of the records of each station (in the order of df), found in one pass
+    station_positions = df.groupby(level='name', sort=False, observed=True).indices
+    datetimes = df.index.get_level_values(level='datetime')
+    for station, positions in station_positions.items():
+        freqs[station] = get_likely_frequency(datetimes[positions])
     return pd.Series(data=freqs)
 
 
 def get_likely_frequency(timestamps):
-    assume_freq = abs(timestamps.to_series().diff().value_counts().index).sort_values(ascending=True)[0]
+    #distinct absolute time differences (in ns) between consecutive records, sorted ascending
+    abs_diffs = np.unique(np.abs(np.diff(timestamps.asi8)))
+    assume_freq = pd.Timedelta(abs_diffs[0])
     
     if assume_freq == pd.to_timedelta(0): #highly likely due to a duplicated record
         # select the second highest frequency
-        assume_freq = abs(timestamps.to_series().diff().value_counts().index).sort_values(ascending=True)[1]
+        assume_freq = pd.Timedelta(abs_diffs[1])
     
     return assume_freq
     
@@ -179,18 +446,20 @@ def missing_timestamp_and_gap_check(df):
     
     
 
-    gap_df = pd.DataFrame()
-    gap_indices = []
-    missing_timestamp_indices = []
+    gap_df_list = [pd.DataFrame()]
+    missing_timestamp_stations = []
+    missing_timestamp_datetimes = []
     station_freqs = {}
     
     #missing timestamp per station (because some stations can have other frequencies!)
 
-    stationnames = df.index.get_level_values(level='name').unique()
-    for station in stationnames:
+    #positions of the records of each station (in the order of df), found in one pass
+    station_positions = df.groupby(level='name', sort=False, observed=True).indices
+    datetimes = df.index.get_level_values(level='datetime')
+    for station, positions in station_positions.items():
         
         #find missing timestamps
-        timestamps = df.xs(station, level='name').index
+        timestamps = datetimes[positions]
         likely_freq = get_likely_frequency(timestamps)
      
         assert likely_freq.seconds > 0, f'The frequency is not positive!' 
@@ -202,50 +471,37 @@ def missing_timestamp_and_gap_check(df):
                                                 freq=likely_freq).difference(timestamps).to_series().diff()
         
         
-        # print(f'station: {station} has {missing_datetimeseries.shape[0]} missing records')
-        #add missing datetimes to the df
-        #multi_idx = pd.MultiIndex.from_arrays(arrays=[[station]*missing_datetimeseries.shape[0], missing_datetimeseries.index.to_list()],
-                                              #sortorder=1,
-                                              #names=['name', 'datetime'])
-        #outlier_sub_df = pd.DataFrame(data=None,
-                                             #index=multi_idx, 
-                                             #columns=None)
-        
-        #df = pd.concat([df, outlier_sub_df])
-       
+        #Check for gaps: consecutive missing records form one group
+        gap_defenition = ((missing_datetimeseries != likely_freq)).cumsum().to_numpy()
+        #the size of the group of each missing record
+        group_size_of_records = np.bincount(gap_defenition)[gap_defenition]
+        is_gap_record = group_size_of_records > check_settings['gaps_finder']['gapsize_n']
         
-        #Check for gaps
-        gap_defenition = ((missing_datetimeseries != likely_freq)).cumsum()
-        consec_missing_groups = missing_datetimeseries.groupby(gap_defenition)
-        group_sizes = consec_missing_groups.size()
-        
-        gap_groups = group_sizes[group_sizes > check_settings['gaps_finder']['gapsize_n']]
-        
-        #iterate over the gabs and fill the gapsdf
-        for gap_idx in gap_groups.index:
-            
-            #fill the gaps df
-            datetime_of_gap_records = consec_missing_groups.get_group(gap_idx).index
-            gap_df = pd.concat([gap_df,
-                               pd.DataFrame(data=[[datetime_of_gap_records.min(),
-                                                  datetime_of_gap_records.max()]],
-                                            index=[station],
-                                            columns=['start_gap', 'end_gap'])])
-            
-            logger.debug(f'Data gap from {datetime_of_gap_records.min()} --> {datetime_of_gap_records.max()} found for {station}.')
-            gap_indices.extend(list(zip([station]*datetime_of_gap_records.shape[0],
-                                        datetime_of_gap_records)))
+        #fill the gaps df with the first and last record of each gap
+        gap_records = missing_datetimeseries.index[is_gap_record]
+        if not gap_records.empty:
+            gap_bounds = gap_records.to_series().groupby(gap_defenition[is_gap_record]).agg(['min', 'max'])
+            gap_df_list.append(pd.DataFrame(data={'start_gap': gap_bounds['min'].array,
+                                                  'end_gap': gap_bounds['max'].array},
+                                            index=[station]*gap_bounds.shape[0]))
+            for start_gap, end_gap in zip(gap_bounds['min'], gap_bounds['max']):
+                logger.debug(f'Data gap from {start_gap} --> {end_gap} found for {station}.')
         
         # combine the missing timestams values
-        missing_timestamp_groups = group_sizes[group_sizes <= check_settings['gaps_finder']['gapsize_n']]
-        for missing_idx in missing_timestamp_groups.index:
-            datetime_of_missing_records=consec_missing_groups.get_group(missing_idx).index
-            missing_timestamp_indices.extend(list(zip([station]*datetime_of_missing_records.shape[0],
-                                        datetime_of_missing_records)))
-    
-    # remove gaps from the observations
-    #df = df.drop(gap_indices)
+        missing_records = missing_datetimeseries.index[~is_gap_record]
+        missing_timestamp_stations.extend([station]*missing_records.shape[0])
+        missing_timestamp_datetimes.append(missing_records)
+    
+    gap_df = pd.concat(gap_df_list)
+    
     # convert missing datetimes to outliers
+    if bool(missing_timestamp_datetimes):
+        missing_timestamp_datetimes = missing_timestamp_datetimes[0].append(missing_timestamp_datetimes[1:])
+    else:
+        missing_timestamp_datetimes = pd.DatetimeIndex([])
+    missing_timestamp_indices = pd.MultiIndex.from_arrays([missing_timestamp_stations,
+                                                           missing_timestamp_datetimes],
+                                                          names=['name', 'datetime'])
     outlier_df = make_outlier_df_for_check(station_dt_list=missing_timestamp_indices,
                                            values_in_dict={column: np.nan for column in df.columns},
                                            flagcolumnname=checks_info[checkname]['label_columnname'],
@@ -256,8 +512,9 @@ def missing_timestamp_and_gap_check(df):
     #df = df.drop(missing_timestamp_indices)
         
         
-    #Sort dataframes
-    df = df.sort_index()
+    #Sort dataframes (the observations are in most cases already sorted)
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index()
     outlier_df = outlier_df.sort_index()
     gap_df = gap_df.sort_index()
     #df = pd.concat([df, outlier_df])
@@ -290,24 +547,22 @@ def duplicate_timestamp_check(df):
 
     
     
-    duplicates = pd.Series(data=df.index.duplicated(keep=check_settings[checkname]['keep']),
-                           index=df.index)
-    
-    if not df.loc[duplicates].empty:
-        logging.warning(f' Following records are labeld as duplicates: {df.loc[duplicates]}, and are removed')
+    duplicates = df.index.duplicated(keep=check_settings[checkname]['keep'])
     
-
     #Fill the outlierdf with the duplicates
-    outliers = df[df.index.duplicated(keep=check_settings[checkname]['keep'])]
+    outliers = df[duplicates]
+    
+    if not outliers.empty:
+        logging.warning(f' Following records are labeld as duplicates: {outliers}, and are removed')
     
     outlierdf = make_outlier_df_for_check(station_dt_list = outliers.index,
                                           values_in_dict = outliers.to_dict(orient='series'),
                                           flagcolumnname=checks_info[checkname]['label_columnname'],
                                           flag=checks_info[checkname]['outlier_flag'])
     
-    #outlierdf = outlierdf[~outlierdf.index.duplicated(keep='first')]
     #Remove duplicates from the observations
-    df = df[~df.index.duplicated(keep=check_settings[checkname]['keep'])]
+    if not outliers.empty:
+        df = df[~duplicates]
     
     
     
@@ -355,20 +610,20 @@ def gross_value_check(input_series, obstype):
 
     
     
-    #find outlier observations as a list of tuples [(name, datetime), (name, datetime)]
-    outl_obs = input_series.loc[(input_series <= specific_settings['min_value']) | 
-                                (input_series >= specific_settings['max_value'])
-                                ].index.to_list()
+    #find outlier observations as a boolean mask
+    values = input_series.to_numpy()
+    outl_mask = (values <= specific_settings['min_value']) | (values >= specific_settings['max_value'])
+    outliers = input_series[outl_mask]
     
     #make outlierdf
-    outlier_df = make_outlier_df_for_check(station_dt_list=outl_obs,
-                                           values_in_dict={obstype:input_series.loc[outl_obs]},
+    outlier_df = make_outlier_df_for_check(station_dt_list=outliers.index,
+                                           values_in_dict={obstype:outliers},
                                            flagcolumnname=obstype+'_'+ checks_info[checkname]['label_columnname'],
                                            flag=checks_info[checkname]['outlier_flag'])
     
     
     #drop outliers from input series
-    input_series = input_series.drop(outl_obs)
+    input_series = input_series[~outl_mask]
     
     return input_series, outlier_df
 
@@ -412,38 +667,37 @@ def persistance_check(station_frequencies, input_series, obstype):
         
         return input_series, init_outlier_multiindexdf()
     
-    #apply persistance
-    def is_unique(window):   #comp order of N (while using the 'unique' function is Nlog(N))
-     
-        a = window.values
-        a = a[~np.isnan(a)]
-        return (a[0] == a).all()
+    #the records of a station must be consecutive
+    if not input_series.index.is_monotonic_increasing:
+        input_series = input_series.sort_index()
     
-            
-    window_output = input_series.reset_index(level=0).groupby('name').rolling(window= specific_settings['time_window_to_check'],
-                                                                            closed='both',
-                                                                            center=True,
-                                                                            min_periods=specific_settings['min_num_obs']).apply(is_unique)
+    #find the centers of the windows where all (non-nan) values are equal (per station)
+    bounds = station_bounds(input_series.index)
+    centers = _persistance_centers(input_series.to_numpy(dtype='float64'),
+                                   input_series.index.get_level_values('datetime').asi8,
+                                   bounds,
+                                   pd.Timedelta(specific_settings['time_window_to_check']).value // 2,
+                                   specific_settings['min_num_obs'])
     
+    #flag all valid records in the windows of the persistance centers
+    half_window_ns, freq_ns = get_window_grid_per_station(input_series.index, bounds,
+                                                          station_frequencies,
+                                                          specific_settings['time_window_to_check'])
+    outl_mask = _window_members_flags(input_series.index.get_level_values('datetime').asi8,
+                                      input_series.notna().to_numpy(),
+                                      centers, bounds, half_window_ns, freq_ns)
     
-    list_of_outliers = []
-    outl_obs = window_output.loc[window_output[obstype] == True].index
-    for outlier in outl_obs:
-        outliers_list = get_outliers_in_daterange(input_series, outlier[1], outlier[0], specific_settings['time_window_to_check'], station_frequencies)
-      
-        list_of_outliers.extend(outliers_list)
-        
-    list_of_outliers = list(set(list_of_outliers))
+    outl_obs = input_series[outl_mask].index
     
     #Create outlier df
-    outlier_df = make_outlier_df_for_check(station_dt_list=list_of_outliers,
-                                           values_in_dict={obstype:input_series.loc[list_of_outliers]},
+    outlier_df = make_outlier_df_for_check(station_dt_list=outl_obs,
+                                           values_in_dict={obstype:input_series[outl_mask]},
                                            flagcolumnname=obstype+'_'+ checks_info[checkname]['label_columnname'],
                                            flag=checks_info[checkname]['outlier_flag'])
     
   
     #drop outliers from input series
-    input_series = input_series.drop(list_of_outliers)
+    input_series = input_series[~outl_mask]
     return input_series, outlier_df
       
 
@@ -484,37 +738,26 @@ def repetitions_check(input_series, obstype):
     
     #find outlier datetimes
     
-    #add time interval between two consecutive records, group by consecutive records without missing records
-   
-    time_diff = input_series.index.get_level_values('datetime').to_series().diff()
-    time_diff.index = input_series.index #back to multiindex
+    #the records of a station must be consecutive
+    if not input_series.index.is_monotonic_increasing:
+        input_series = input_series.sort_index()
     
-    persistance_filter = ((input_series.shift() != input_series)).cumsum()
+    #flag the runs of consecutive equal values that are too long (per station)
+    outl_mask = _run_length_flags(input_series.to_numpy(dtype='float64'),
+                                  station_bounds(input_series.index),
+                                  specific_settings['max_valid_repetitions'])
     
-
-    grouped = input_series.groupby(['name', persistance_filter]) 
-    #the above line groups the observations which have the same value and consecutive datetimes.
-    group_sizes = grouped.size()
-    outlier_groups = group_sizes[group_sizes > specific_settings['max_valid_repetitions']]
-    
-
-    
-    #add to outl_obs.
-    outl_obs = []
-    for group_idx in outlier_groups.index:
-        groupseries = grouped.get_group(group_idx)
-        if len(set(groupseries)) == 1: #Check if all observations are equal in group
-            outl_obs.extend(groupseries.index.to_list())
+    outl_obs = input_series[outl_mask].index
     
     #Create outlier df
     outlier_df = make_outlier_df_for_check(station_dt_list=outl_obs,
-                                           values_in_dict={obstype:input_series.loc[outl_obs]},
+                                           values_in_dict={obstype:input_series[outl_mask]},
                                            flagcolumnname=obstype+'_'+ checks_info[checkname]['label_columnname'],
                                            flag=checks_info[checkname]['outlier_flag'])
     
    
     #drop outliers from input series
-    input_series = input_series.drop(outl_obs)
+    input_series = input_series[~outl_mask]
     
     return input_series, outlier_df
 
@@ -557,28 +800,24 @@ def step_check(input_series, obstype):
         logger.warning(f'No {checkname} settings found for obstype={obstype}. Check is skipped!')
         return input_series, init_outlier_multiindexdf()
     
-    list_of_outliers = []
+    #the records of a station must be consecutive
+    if not input_series.index.is_monotonic_increasing:
+        input_series = input_series.sort_index()
     
-    for name in input_series.index.droplevel('datetime').unique():
-        subdata = input_series.xs(name, level='name', drop_level=False)
-        
-        time_diff = subdata.index.get_level_values('datetime').to_series().diff()
-        time_diff.index = subdata.index #back to multiindex
-        #define filter
-        step_filter = (((subdata - subdata.shift(1)) > (specific_settings['max_increase_per_second']*time_diff.dt.total_seconds())) | ((subdata - subdata.shift(1)) < (specific_settings['max_decrease_per_second']*time_diff.dt.total_seconds()))) #& 
-                       #(time_diff == station_frequencies[name]))
-        outl_obs = step_filter[step_filter==True].index
-        
-     
-        list_of_outliers.extend(outl_obs)
-        
-    outlier_df = make_outlier_df_for_check(station_dt_list=list_of_outliers,
-                                           values_in_dict={obstype:input_series.loc[list_of_outliers]},
+    #flag the steps with respect to the previous record (per station)
+    outl_mask = _step_flags(input_series.to_numpy(dtype='float64'),
+                            input_series.index.get_level_values('datetime').values.astype('int64'),
+                            station_bounds(input_series.index),
+                            specific_settings['max_increase_per_second'],
+                            specific_settings['max_decrease_per_second'])
+    
+    outlier_df = make_outlier_df_for_check(station_dt_list=input_series[outl_mask].index,
+                                           values_in_dict={obstype:input_series[outl_mask]},
                                            flagcolumnname=obstype+'_'+ checks_info[checkname]['label_columnname'],
                                            flag=checks_info[checkname]['outlier_flag'])
     
     
-    input_series = input_series.drop(list_of_outliers)
+    input_series = input_series[~outl_mask]
     
     return input_series, outlier_df
 
@@ -632,62 +871,72 @@ def window_variation_check(station_frequencies, input_series, obstype):
     max_window_decrease = specific_settings['max_decrease_per_second'] * windowsize_seconds
     
 
-    #apply steptest
-    def variation_test(window):
-        if ((max(window) - min(window) > max_window_increase) & 
-            (window.idxmax() > window.idxmin())):
-            return 1
-
-        if ((max(window) - min(window) > max_window_decrease) & 
-            (window.idxmax() < window.idxmin())):
-            return 1
-        else:
-            return 0
-
-    window_output = input_series.reset_index(level=0).groupby('name').rolling(window=specific_settings['time_window_to_check'],
-                                                                            closed='both',
-                                                                            center=True,
-                                                                            min_periods=specific_settings['min_window_members']).apply(variation_test)
-
-    list_of_outliers = []
-    outl_obs = window_output.loc[window_output[obstype] == 1].index
-
-    for outlier in outl_obs:
-        outliers_list = get_outliers_in_daterange(input_series, outlier[1], outlier[0], specific_settings['time_window_to_check'], station_frequencies)
-      
-        list_of_outliers.extend(outliers_list)
-        
-    list_of_outliers = list(set(list_of_outliers))
+    #the records of a station must be consecutive
+    if not input_series.index.is_monotonic_increasing:
+        input_series = input_series.sort_index()
+    
+    #find the centers of the windows with a too large variation (per station)
+    bounds = station_bounds(input_series.index)
+    centers = _window_variation_centers(input_series.to_numpy(dtype='float64'),
+                                        input_series.index.get_level_values('datetime').asi8,
+                                        bounds,
+                                        pd.Timedelta(specific_settings['time_window_to_check']).value // 2,
+                                        specific_settings['min_window_members'],
+                                        max_window_increase, max_window_decrease)
+    
+    #flag all valid records in the windows of the window variation centers
+    half_window_ns, freq_ns = get_window_grid_per_station(input_series.index, bounds,
+                                                          station_frequencies,
+                                                          specific_settings['time_window_to_check'])
+    outl_mask = _window_members_flags(input_series.index.get_level_values('datetime').asi8,
+                                      input_series.notna().to_numpy(),
+                                      centers, bounds, half_window_ns, freq_ns)
+    
+    outl_obs = input_series[outl_mask].index
     
     #Create outlier df
-    outlier_df = make_outlier_df_for_check(station_dt_list=list_of_outliers,
-                                           values_in_dict={obstype:input_series.loc[list_of_outliers]},
+    outlier_df = make_outlier_df_for_check(station_dt_list=outl_obs,
+                                           values_in_dict={obstype:input_series[outl_mask]},
                                            flagcolumnname=obstype+'_'+ checks_info[checkname]['label_columnname'],
                                            flag=checks_info[checkname]['outlier_flag'])
    
    
     #drop outliers from input series
-    input_series = input_series.drop(list_of_outliers)
+    input_series = input_series[~outl_mask]
     
     return input_series, outlier_df
 
-def get_outliers_in_daterange(input_data, date, name, time_window, station_freq):
-    end_date = date + (pd.Timedelta(time_window)/2).floor(station_freq[name])
-    start_date = date - (pd.Timedelta(time_window)/2).floor(station_freq[name])
-    
-    daterange = pd.date_range(start=start_date, end = end_date, freq=station_freq[name])
-    
-    multi_idx = pd.MultiIndex.from_arrays(arrays=[[name]*len(daterange), daterange.to_list()],
-                                          sortorder=1,
-                                          names=['name', 'datetime'])
-    outlier_sub_df = pd.DataFrame(data=None,
-                                         index=multi_idx, 
-                                         columns=None)
-    
-    
-    intersection = outlier_sub_df.index.intersection(input_data.dropna().index).values
-    
-    return intersection
+def get_window_grid_per_station(index, bounds, station_freq, time_window):
+    """
+    Get the half window size (floored to the station frequency) and the station
+    frequency, both in nanoseconds, for each station in the (sorted) index. The
+    records of a window around t are those on the grid t - half_window + k*freq,
+    up to t + half_window.
+
+    Parameters
+    ----------
+    index : pandas.MultiIndex
+        The (name, datetime) index, sorted on name.
+    bounds : numpy.array
+        The station bounds of the index (see station_bounds).
+    station_freq : pandas.Series
+        The frequency (values) per station (index).
+    time_window : String
+        The time window of the check.
+
+    Returns
+    -------
+    half_window_ns : numpy.array
+        The half window size per station in nanoseconds.
+    freq_ns : numpy.array
+        The frequency per station in nanoseconds.
+
+    """
+    names = index.get_level_values('name')[bounds[:-1]]
+    freqs = [pd.Timedelta(station_freq[name]) for name in names]
+    half_window_ns = np.array([(pd.Timedelta(time_window)/2).floor(freq).value for freq in freqs], dtype='int64')
+    freq_ns = np.array([freq.value for freq in freqs], dtype='int64')
+    return half_window_ns, freq_ns
 
 # def compute_dew_point(df, spec_settings):
 #     dew_temp = spec_settings['c']*np.log(df['humidity']/100 *np.exp((spec_settings['b'] - df['temp']/spec_settings['d']) * (df['temp']/(spec_settings['c'] + df['temp']))))/(spec_settings['b'] - np.log(df['humidity']/100 *np.exp((spec_settings['b'] - df['temp']/spec_settings['d']) * (df['temp']/(spec_settings['c'] + df['temp'])))))
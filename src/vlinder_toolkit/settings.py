@@ -30,10 +30,14 @@ class Settings:
    
     input_metadata_file = None
     input_metadata_template = None
+    fast_io = False #Read the observations csv file with pyarrow (if installed), the metadata file is always read with pyarrow (if installed)
+    cache_folder = None #If a folder is given, the formatted observations of a csv file are cached there as parquet (if pyarrow is installed)
     
     #Geo datasets templates and info
     geo_datasets_templates = None
     geo_lcz_file = None
+    lcz_template = None #The (only) geo template with usage 'LCZ'
+    lcz_human_mapper = None #LCZ class number --> cover name
     
     #String mappers for display
     display_name_mapper = None
@@ -162,6 +166,16 @@ class Settings:
        #import geo datasets templates
        Settings.geo_datasets_templates = geo_datasets
        
+       #the lcz template and its class mapper are fixed, so they are looked up once
+       lcz_templates = [geo_templ for geo_templ in geo_datasets if geo_templ['usage']=='LCZ']
+       if len(lcz_templates) == 1:
+           Settings.lcz_template = lcz_templates[0]
+           Settings.lcz_human_mapper = {num: Settings.lcz_template['covers'][num]['cover_name'] 
+                                        for num in Settings.lcz_template['covers'].keys()}
+       else:
+           Settings.lcz_template = None
+           Settings.lcz_human_mapper = None
+       
        
        #Set standard templates
        
@@ -171,7 +185,8 @@ class Settings:
     
     @classmethod
     def update_settings(self, output_folder=None, input_data_file=None,
-                        input_metadata_file=None, geotiff_lcz_file=None):
+                        input_metadata_file=None, geotiff_lcz_file=None,
+                        fast_io=None, cache_folder=None):
 
         logger.info('Updating settings with input: ')
 
@@ -197,6 +212,16 @@ class Settings:
             logger.info(f'Update geotiff_LCZ_file:  {self.geo_lcz_file}  -->  {geotiff_lcz_file}')
             Settings.geo_lcz_file = geotiff_lcz_file
         
+        if not isinstance(fast_io, type(None)):    
+            print('Update fast_io: ', self.fast_io, ' --> ', fast_io)
+            logger.info(f'Update fast_io:  {self.fast_io}  -->  {fast_io}')
+            Settings.fast_io = fast_io
+        
+        if not isinstance(cache_folder, type(None)):    
+            print('Update cache_folder: ', self.cache_folder, ' --> ', cache_folder)
+            logger.info(f'Update cache_folder:  {self.cache_folder}  -->  {cache_folder}')
+            Settings.cache_folder = cache_folder
+        
         
     def add_excel_template(self, excel_file):
         """
@@ -16,6 +16,9 @@ logger = logging.getLogger(__name__)
 
 #%%
 class Station:
+    #fixed set of attributes, no per-instance __dict__
+    __slots__ = ('name', 'df', 'outliersdf', 'gapsdf', 'meta_series', 'data_template')
+    
     def __init__(self, name, df, outliersdf, gapsdf, meta_series, data_template):
         self.name = name
         self.df = df
@@ -100,7 +100,7 @@ def get_qc_effectiveness_stats(outliersdf, df, obstype, observation_types, qc_la
     
     
     #Convert to df and make pieplot
-    qc_counts_df = pd.DataFrame().from_dict(qc_countings_dict)
+    qc_counts_df = pd.DataFrame.from_dict(qc_countings_dict)
 
     # 4. Convert to persentages
     qc_percentage_df = qc_counts_df.div(qc_counts_df.sum(axis=0)) * 100.